@@ -1,17 +1,32 @@
 #!/bin/env python
 from __future__ import print_function
 import re
+import threading
 
 try:
     from reprlib import recursive_repr
 except Exception:
     recursive_repr = lambda: lambda x: x
 from copy import copy as _copy
+from collections import OrderedDict
+from functools import partial
+from itertools import repeat
+from operator import is_ as _is
+
+try:
+    # map pads the shorter iterables with None on Python 2, it would
+    # never stop with repeat()
+    from itertools import imap as _imap
+except ImportError:
+    _imap = map
 
 
 __version__ = '1.4.1'
 
 
+_MISSING = object()
+
+
 class TypeMismatchException(Exception):
     def __init__(self, value, type_, info = None):
         Exception.__init__(self, repr(value) + " cannot match type " \
@@ -26,7 +41,7 @@ class TypeMismatchException(Exception):
     
     @property
     def path(self):
-        return '.'.join(str(p) for p in reversed(self._path))
+        return '.'.join(map(str, reversed(self._path)))
     
     def __str__(self):
         s = Exception.__str__(self)
@@ -92,13 +107,36 @@ class NoMatch(object):
 class CustomizedChecker(object):
     """
     Inherit from this class to create a customized type checker
+    
+    Checkers are pickled with the values of their slots, so they can
+    be pickled with any protocol::
+    
+        >>> import pickle
+        >>> pickle.loads(pickle.dumps(list_([int], strict = True), 0)).strict
+        True
+        >>> pickle.loads(pickle.dumps(type_(int), 1)) # doctest: +ELLIPSIS
+        type_(<... 'int'>)
     """
+    __slots__ = ('__weakref__',)
+
     def __init__(self, *args, **kwargs):
         """
         Call bind()
         """
         if args or kwargs:
             self.bind(*args, **kwargs)
+    def __getstate__(self):
+        # Pickle protocol 0 and 1 do not support __slots__ by default
+        state = dict(getattr(self, '__dict__', ()))
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name != '__weakref__' and name != '__dict__' and \
+                        hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
     def bind(self):
         """
         Allow delayed init
@@ -134,7 +172,10 @@ class CustomizedChecker(object):
                                      recursive_check_type(value, type, path=None)
                                      to be called to do recursive type
                                      check. When the call fails, path is automatically
-                                     joined to create a property path
+                                     joined to create a property path.
+                                     It never modifies the value being
+                                     checked, so value can be iterated
+                                     directly without making a copy
         """
         raise NotImplementedError
 
@@ -449,10 +490,104 @@ allowed types are: <... 'collections.defaultdict'>
        Traceback (most recent call last):
           ...
        TypeMismatchException: At 'abc.<Key>': 'abc' cannot match type <... 'int'>
+       >>> my_type = {"abc": int}
+       >>> check_type({"abc": 1}, my_type)
+       {'abc': 1}
+       >>> my_type["abc"] = str
+       >>> check_type({"abc": 1}, my_type) # doctest: +ELLIPSIS
+       Traceback (most recent call last):
+          ...
+       TypeMismatchException: At 'abc': 1 cannot match type <... 'str'>
     """
+    # Fast path for simple types: no recursive check is needed
+    # when they match
+    if type is int or type is _long:
+        if _builtin_type(value) is int or \
+                (not isinstance(value, bool) and isinstance(value, _INT_TYPES)):
+            return value
+    elif type is str or type is _unicode:
+        if _builtin_type(value) is str or isinstance(value, _STR_TYPES):
+            return value
+    elif isinstance(type, _builtin_type):
+        if isinstance(value, type):
+            return value
     return _check_type_inner(value, type)
 
 
+# Results of check_type_cached, key is the check id,
+# value is (value, type_, result)
+_result_cache = OrderedDict()
+
+_RESULT_CACHE_SIZE = 1024
+
+
+def check_type_cached(value, type):
+    """
+    Same as `check_type`, but remembers the recent successful checks
+    of immutable values (numbers, strings, and tuples or frozensets
+    of them) which return the value itself, so checking the same value against the
+    same type again is only a lookup. Other values are always checked
+    with `check_type`.
+    
+    `type` must not be modified after it is used with this function.
+    
+    Examples::
+    
+        >>> calls = []
+        >>> t = extra(int, check = lambda x: calls.append(x) or True)
+        >>> v = 12345
+        >>> check_type_cached(v, t)
+        12345
+        >>> check_type_cached(v, t)
+        12345
+        >>> len(calls)
+        1
+        >>> v = (1, "abc")
+        >>> check_type_cached(v, ({"a": int}, tuple)) is v
+        True
+        >>> class C(object): pass
+        >>> c = C()
+        >>> c.port = 80
+        >>> t = extra(tuple, check = lambda x: x[0].port > 0)
+        >>> v = (c,)
+        >>> check_type_cached(v, t) is v
+        True
+        >>> c.port = -1
+        >>> check_type_cached(v, t) # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+            ...
+        TypeMismatchException: (<...>,) cannot match type extra(<... 'tuple'>): check returns False
+        >>> check_type_cached(1, [int])
+        [1]
+        >>> check_type_cached(True, int) # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+            ...
+        TypeMismatchException: True cannot match type <... 'int'>
+    """
+    if isinstance(type, _builtin_type):
+        # int, str and other classes are checked by the fast path
+        # of check_type
+        return check_type(value, type)
+    if _builtin_type(type) in _NEW_VALUE_TYPES or \
+            not _is_immutable(value):
+        return check_type(value, type)
+    check_id = id(value) << 64 | id(type)
+    cached = _result_cache.pop(check_id, None)
+    if cached is not None:
+        # move to the end
+        _result_cache[check_id] = cached
+        return cached[2]
+    result = check_type(value, type)
+    if result is value:
+        # store value and type to prevent the ids from being reused
+        _result_cache[check_id] = (value, type, result)
+        while len(_result_cache) > _RESULT_CACHE_SIZE:
+            _result_cache.popitem(last=False)
+    return result
+
+
+_builtin_type = type
+
 try:
     _long = long
 except Exception:
@@ -463,6 +598,36 @@ try:
 except Exception:
     _unicode = str
 
+try:
+    _bytes = bytes
+except Exception:
+    _bytes = str
+
+
+_INT_TYPES = (int,) if _long is int else (int, _long)
+
+_STR_TYPES = (str,) if _unicode is str else (str, _unicode)
+
+# Types with extended matching rules in _check_type_inner, other
+# types are matched by isinstance
+_PRIMITIVE_TYPES = frozenset(_INT_TYPES + _STR_TYPES)
+
+# Values exactly in these types never change. Subclasses may have
+# mutable attributes
+_IMMUTABLE_TYPES = frozenset((bool, int, _long, float, complex, str, _unicode,
+                              _bytes, type(None)))
+
+
+def _is_immutable(value):
+    t = type(value)
+    if t in _IMMUTABLE_TYPES:
+        return True
+    elif t is tuple or t is frozenset:
+        # a hashable tuple may still contain mutable objects
+        return all(map(_is_immutable, value))
+    else:
+        return False
+
 
 class ListChecker(CustomizedChecker):
     """
@@ -476,11 +641,28 @@ class ListChecker(CustomizedChecker):
         Traceback (most recent call last):
           ...
         InvalidTypeException: {} is not a valid type: must be a list
+        >>> check_type([1.0, 2, 3.0], [float]) # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+          ...
+        TypeMismatchException: At '1': 2 cannot match type <... 'float'>
+        >>> t = list_([int], allowed_type = (list, tuple, type(iter([]))))
+        >>> check_type(iter([1, 2, 3]), t)
+        [1, 2, 3]
+        >>> check_type(iter([1, True, 3]), t) # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+          ...
+        TypeMismatchException: At '1': True cannot match type <... 'int'>
+        >>> t = list_([float], allowed_type = (list, type(x for x in ())))
+        >>> check_type((x / 2.0 for x in range(3)), t)
+        [0.0, 0.5, 1.0]
     """
+    __slots__ = ('type_', 'strict', 'allowed_type')
+
     def bind(self, type_, strict = False,
                 allowed_type = (list, tuple)):
         """
-        `type_` must be a list type [] / [sub_type]
+        `type_` must be a list type [] / [sub_type]. It should not be
+        modified after bind.
         
         :param strict: if True, auto-convert from a single value
                        to a list is disabled
@@ -496,34 +678,106 @@ class ListChecker(CustomizedChecker):
         self.strict = strict
         self.allowed_type = allowed_type
 
+    def _specialized_checks(self):
+        """
+        Return (pre_check_type, final_check_type) selected for the
+        current binding, which do not test the type and the mode on
+        every check
+        """
+        if self.strict:
+            pre_check_type = self._pre_check_strict
+        else:
+            pre_check_type = self._pre_check_loose
+        type_ = self.type_
+        if not type_:
+            final_check_type = self._final_check_any
+        elif isinstance(type_[0], type):
+            if type_[0] in _PRIMITIVE_TYPES:
+                final_check_type = self._final_check_primitive
+            else:
+                final_check_type = self._final_check_class
+        else:
+            final_check_type = self._final_check_typed
+        return pre_check_type, final_check_type
+
     def __repr__(self):
         return repr(self.type_)
         
     def pre_check_type(self, value):
+        if self.strict:
+            return self._pre_check_strict(value)
+        else:
+            return self._pre_check_loose(value)
+
+    def _pre_check_loose(self, value):
         if isinstance(value, self.allowed_type):
             return []
-        elif self.strict:
-            raise TypeMismatchException(value, self.type_,
-                "strict mode disables auto-convert-to-list for single value")
         else:
             return None
+
+    def _pre_check_strict(self, value):
+        if isinstance(value, self.allowed_type):
+            return []
+        else:
+            raise TypeMismatchException(value, self.type_,
+                "strict mode disables auto-convert-to-list for single value")
             
     def final_check_type(self, value, current_result, recursive_check_type):
         if not self.type_:
-            # matches any list or tuple
-            if current_result is None:
-                return [value]
+            return self._final_check_any(value, current_result,
+                                         recursive_check_type)
+        elif isinstance(self.type_[0], type):
+            if self.type_[0] in _PRIMITIVE_TYPES:
+                return self._final_check_primitive(value, current_result,
+                                                   recursive_check_type)
             else:
-                current_result.extend(value)
-                return current_result
+                return self._final_check_class(value, current_result,
+                                               recursive_check_type)
         else:
-            subtype = self.type_[0]
-            if current_result is not None:
-                current_result.extend(recursive_check_type(o, subtype, i)
-                                      for i,o in enumerate(value))
-                return current_result
-            else:
-                return [recursive_check_type(value, subtype)]
+            return self._final_check_typed(value, current_result,
+                                           recursive_check_type)
+
+    def _final_check_any(self, value, current_result, recursive_check_type):
+        # matches any list or tuple
+        if current_result is None:
+            return [value]
+        else:
+            current_result.extend(value)
+            return current_result
+
+    def _final_check_primitive(self, value, current_result, recursive_check_type):
+        # Items exactly in a primitive type always match; check them in
+        # one pass before checking every item (e.g. for bool in [int]).
+        # Other allowed types (e.g. iterators) may only be read once
+        if current_result is not None and \
+                (type(value) is list or type(value) is tuple) and \
+                all(_imap(_is, _imap(type, value), repeat(self.type_[0]))):
+            current_result.extend(value)
+            return current_result
+        return self._final_check_typed(value, current_result,
+                                       recursive_check_type)
+
+    def _final_check_class(self, value, current_result, recursive_check_type):
+        # A class matches its instances without converting them, so
+        # isinstance can test all the items in one pass. Other allowed
+        # types (e.g. iterators) may only be read once
+        if current_result is not None and \
+                (type(value) is list or type(value) is tuple) and \
+                all(_imap(isinstance, value, repeat(self.type_[0]))):
+            current_result.extend(value)
+            return current_result
+        return self._final_check_typed(value, current_result,
+                                       recursive_check_type)
+
+    def _final_check_typed(self, value, current_result, recursive_check_type):
+        subtype = self.type_[0]
+        if current_result is not None:
+            append = current_result.append
+            for i, o in enumerate(value):
+                append(recursive_check_type(o, subtype, i))
+            return current_result
+        else:
+            return [recursive_check_type(value, subtype)]
 
                 
 list_ = ListChecker
@@ -541,7 +795,21 @@ class DictChecker(CustomizedChecker):
         Traceback (most recent call last):
           ...
         InvalidTypeException: [] is not a valid type: must be a dict
+        >>> check_type({1: "abc", "?2": 3}, {1: str, "?2": int})
+        {1: 'abc', '?2': 3}
+        >>> check_type({"abc": "x"}, OrderedDict([("~b", str), ("~a", int)]))
+        {'abc': 'x'}
+        >>> check_type({"abc": 1}, {"~(?u)abc": int, "~x": str})
+        {'abc': 1}
+        >>> import copy, pickle
+        >>> t = pickle.loads(pickle.dumps(dict_({"~a": int})))
+        >>> check_type({"abc": 1}, copy.deepcopy(t))
+        {'abc': 1}
     """
+    __slots__ = ('type_', 'allowed_type', 'created_type', 'required_keys',
+                 '_required_names', '_required_messages', 'optional_keys',
+                 'all_keys', 'regexp_keys', '_regexp_searches')
+
     def bind(self, type_, allowed_type = dict, created_type = dict):
         """
         :param type_: a dict describing the input format
@@ -557,23 +825,42 @@ class DictChecker(CustomizedChecker):
         self.type_ = type_
         self.allowed_type = allowed_type
         self.created_type = created_type
-        self.required_keys = dict((k[1:]
-                                  if isinstance(k, str)
-                                      and k.startswith('!')
-                                  else k, v)
-                                  for k,v in self.type_.items()
-                                  if not isinstance(k, str)
-                                  or (not k.startswith('?')
-                                    and not k.startswith('~')))
-        self.optional_keys = dict((k[1:], v) for k, v in self.type_.items()
-                                  if k.startswith('?'))
-        self.optional_keys.update(self.required_keys)
-        self.regexp_keys = [(k[1:], v) for k, v in self.type_.items()
-                            if k.startswith('~')]
+        # Split the keys in a single pass, the prefixes are stripped here
+        # so checks do not need to process the keys again
+        required_keys = {}
+        optional_keys = {}
+        regexp_keys = []
+        for k, v in type_.items():
+            if isinstance(k, _STR_TYPES):
+                prefix = k[:1]
+                if prefix == '?':
+                    optional_keys[k[1:]] = v
+                    continue
+                elif prefix == '~':
+                    regexp_keys.append((re.compile(k[1:]), v))
+                    continue
+                elif prefix == '!':
+                    k = k[1:]
+            required_keys[k] = v
+        all_keys = dict(optional_keys)
+        all_keys.update(required_keys)
+        self.required_keys = required_keys
+        self._required_names = tuple(required_keys)
+        # error messages for missing keys are also prepared here
+        self._required_messages = required_messages = {}
+        for k in required_keys:
+            required_messages[k] = 'key ' + repr(k) + ' is required'
+        self.optional_keys = optional_keys
+        self.all_keys = all_keys
+        self.regexp_keys = regexp_keys
+        # (bound search method, type) of the regular expressions in order
+        self._regexp_searches = tuple((p.search, v) for p, v in regexp_keys)
 
         
     def pre_check_type(self, value):
-        if not isinstance(value, self.allowed_type):
+        # Most values are exactly the allowed type
+        if type(value) is not self.allowed_type and \
+                not isinstance(value, self.allowed_type):
             raise TypeMismatchException(value, self.type_,
                     "allowed types are: " + repr(self.allowed_type))
         return self.created_type()
@@ -583,26 +870,29 @@ class DictChecker(CustomizedChecker):
             current_result.update(value)
         else:
             # check required keys
-            for k in self.required_keys:
-                if k not in value:
-                    raise TypeMismatchException(value, self.type_, 'key '
-                        + repr(k) + ' is required')
-            optional_keys = self.optional_keys
+            required_names = self._required_names
+            if required_names and \
+                    not all(map(value.__contains__, required_names)):
+                for k in required_names:
+                    if k not in value:
+                        raise TypeMismatchException(value, self.type_,
+                                self._required_messages[k])
+            # bind the methods to locals, they are used for every key
+            get_type = self.all_keys.get
+            regexp_searches = self._regexp_searches
+            missing = _MISSING
             for k, v in value.items():
-                if k in optional_keys:
-                    current_result[k] = recursive_check_type(v,
-                                                     optional_keys[k],
-                                                     k)
-                else:
-                    for rk, rv in self.regexp_keys:
-                        if re.search(rk, k):
-                            current_result[k] = recursive_check_type(
-                                                        v,
-                                                        rv,
-                                                        k)
+                t = get_type(k, missing)
+                if t is missing and regexp_searches:
+                    # the first matching expression wins
+                    for search, rt in regexp_searches:
+                        if search(k) is not None:
+                            t = rt
                             break
-                    else:
-                        current_result[k] = v
+                if t is missing:
+                    current_result[k] = v
+                else:
+                    current_result[k] = recursive_check_type(v, t, k)
         return current_result
     
     def __repr__(self):
@@ -672,6 +962,8 @@ tuple_([...])
 and return list instead of tuple
         [[...], 123]
     """
+    __slots__ = ('type_', 'allowed_type', 'allow_recursive')
+
     def bind(self, tuple_of_types, allowed_type = (list, tuple),
             allow_recursive = False):
         """
@@ -711,12 +1003,14 @@ and return list instead of tuple
             return None
     
     def final_check_type(self, value, current_result, recursive_check_type):
+        # map() calls recursive_check_type(v, t, i) for each position
+        # without a generator frame
+        type_ = self.type_
+        checked = map(recursive_check_type, value, type_, range(len(type_)))
         if current_result is None:
-            return tuple(recursive_check_type(v, t, i)
-                         for i, (v, t) in enumerate(zip(value, self.type_)))
+            return tuple(checked)
         else:
-            current_result.extend(recursive_check_type(v, t, i)
-                                  for i, (v, t) in enumerate(zip(value, self.type_)))
+            current_result.extend(checked)
             return current_result
 
 
@@ -745,6 +1039,8 @@ map_(<... 'int'>, <... 'str'>): allowed types are: <... 'dict'>
         >>> check_type(d, m)
         {1: {...}}
     """
+    __slots__ = ('key_type', 'value_type', 'allowed_type', 'created_type')
+
     def bind(self, key_type, value_type, allowed_type = dict,
                 created_type = dict):
         """
@@ -762,17 +1058,19 @@ map_(<... 'int'>, <... 'str'>): allowed types are: <... 'dict'>
         self.created_type = created_type
     
     def pre_check_type(self, value):
-        if not isinstance(value, self.allowed_type):
+        if type(value) is not self.allowed_type and \
+                not isinstance(value, self.allowed_type):
             raise TypeMismatchException(value, self,
                     "allowed types are: " + repr(self.allowed_type))
         return {}
         
     def final_check_type(self, value, current_result, recursive_check_type):
-        current_result.update(
-                (recursive_check_type(k, self.key_type, '<Key>'),
-                    recursive_check_type(v, self.value_type, k))
-                for k, v in list(value.items())
-        )
+        key_type = self.key_type
+        value_type = self.value_type
+        for k, v in value.items():
+            # check the key before the value
+            checked_key = recursive_check_type(k, key_type, '<Key>')
+            current_result[checked_key] = recursive_check_type(v, value_type, k)
         return current_result
     
     @recursive_repr()
@@ -784,6 +1082,12 @@ map_(<... 'int'>, <... 'str'>): allowed types are: <... 'dict'>
 map_ = MapChecker
 
 
+# These types always create a new value, check_type_cached never
+# caches their results
+_NEW_VALUE_TYPES = frozenset((list, dict, ListChecker, DictChecker,
+                              TupleChecker, MapChecker))
+
+
 def _parse_checker(check, default_msg):
     if check is None or callable(check):
         return check, default_msg
@@ -886,8 +1190,27 @@ check_before returns False
         True
         >>> r['children'][1] is r
         True
+        >>> import gc, weakref
+        >>> class B(object): pass
+        >>> b = B()
+        >>> ref = weakref.ref(b)
+        >>> check_type(1, (str, extra(int, check = lambda x, b = b: True)))
+        1
+        >>> check_type([1], [extra(int, check = lambda x, b = b: True)])
+        [1]
+        >>> check_type({"a": [1]},
+        ...            {"a": [(str, extra(int, check = lambda x, b = b: True))]})
+        {'a': [1]}
+        >>> del b
+        >>> _ = gc.collect()
+        >>> ref() is None
+        True
                             
     """
+    __slots__ = ('basictype', '_check', '_check_msg', '_check_before',
+                 '_check_before_msg', '_convert', '_convert_before',
+                 '_precreate', '_merge', '_recursive')
+
     def bind(self, basictype = object, check = None,
                                        check_before = None,
                                        convert = None,
@@ -950,26 +1273,32 @@ check_before returns False
             self._recursive = False
     
     def pre_check_type(self, value):
-        if self._check_before is not None:
-            if not _guard_checker(value, self, self._check_before, value):
+        check_before = self._check_before
+        if check_before is not None:
+            if not _guard_checker(value, self, check_before, value):
                 raise TypeMismatchException(value, self,
                         self._check_before_msg)
-        if self._precreate is not None:
-            return _guard_checker(value, self, self._precreate, value)
+        precreate = self._precreate
+        if precreate is not None:
+            return _guard_checker(value, self, precreate, value)
         else:
             return None
     
     def final_check_type(self, value, current_result, recursive_check_type):
+        # each step is read once, most of them are None
         origin_value = value
-        if self._convert_before is not None:
-            value = _guard_checker(origin_value, self, self._convert_before, value)
+        convert_before = self._convert_before
+        if convert_before is not None:
+            value = _guard_checker(origin_value, self, convert_before, value)
         r = recursive_check_type(value, self.basictype)
-        if self._check is not None:
-            if not _guard_checker(origin_value, self, self._check, r):
+        check = self._check
+        if check is not None:
+            if not _guard_checker(origin_value, self, check, r):
                 raise TypeMismatchException(origin_value, self,
                         self._check_msg)
-        if self._convert is not None:
-            r = _guard_checker(origin_value, self, self._convert, r)
+        convert = self._convert
+        if convert is not None:
+            r = _guard_checker(origin_value, self, convert, r)
         if current_result is not None:
             _guard_checker(origin_value, self, self._merge, current_result, r)
             return current_result
@@ -1109,6 +1438,10 @@ check_before returns False
         TypeMismatchException: ... cannot match type ...: \
 check returns False
     """
+    __slots__ = ('object_type', 'property_check', '_recreate_object',
+                 '_check', '_check_msg', '_check_before', '_check_before_msg',
+                 '_modify', '_merge')
+
     def bind(self, object_type, property_check = {},
                                 recreate_object = True,
                                 check = None,
@@ -1156,27 +1489,38 @@ check returns False
         self._merge = merge
     
     def pre_check_type(self, value):
-        if not isinstance(value, self.object_type):
+        object_type = self.object_type
+        if type(value) is not object_type and \
+                not isinstance(value, object_type):
             raise TypeMismatchException(value, self, "class type mismatch")
-        if self._check_before is not None:
-            if not _guard_checker(value, self, self._check_before, value):
+        check_before = self._check_before
+        if check_before is not None:
+            if not _guard_checker(value, self, check_before, value):
                 raise TypeMismatchException(value, self,
                         self._check_before_msg)
-        if self._recreate_object is not None:
-            return _guard_checker(value, self, self._recreate_object)
+        recreate_object = self._recreate_object
+        if recreate_object is not None:
+            return _guard_checker(value, self, recreate_object)
         else:
             return value
     
     def final_check_type(self, value, current_result, recursive_check_type):
+        # each step is read once, most of them are None
         d = recursive_check_type(value.__dict__, self.property_check)
-        if self._merge is not None:
-            _guard_checker(value, self, self._merge, current_result, d)
-        if self._check is not None:
-            if not _guard_checker(value, self, self._check, current_result):
+        merge = self._merge
+        if merge is default_object_merger:
+            # the default merger is inlined
+            current_result.__dict__.update(d)
+        elif merge is not None:
+            _guard_checker(value, self, merge, current_result, d)
+        check = self._check
+        if check is not None:
+            if not _guard_checker(value, self, check, current_result):
                 raise TypeMismatchException(value, self,
                         self._check_msg)
-        if self._modify is not None:
-            _guard_checker(value, self, self._modify, current_result)
+        modify = self._modify
+        if modify is not None:
+            _guard_checker(value, self, modify, current_result)
         return current_result
         
     @recursive_repr()
@@ -1206,7 +1550,9 @@ class TypeChecker(ExtraChecker):
           ...
         TypeMismatchException: <... 'str'> cannot match type type_(<... 'int'>): must be a subclass of <... 'int'>
     """
-    def _check(self, value):
+    __slots__ = ('_baseclass', '_metaclass')
+
+    def _check_subclass(self, value):
         if not issubclass(value, self._baseclass):
             raise TypeMismatchException(value, self, "must be a subclass of " + repr(self._baseclass))
         return True
@@ -1226,7 +1572,7 @@ class TypeChecker(ExtraChecker):
         else:
             if not isinstance(baseclass, type):
                 raise InvalidTypeException(self, repr(metaclass) + " is not a baseclass")
-            ExtraChecker.bind(self, metaclass, check=self._check)
+            ExtraChecker.bind(self, metaclass, check=self._check_subclass)
 
     def __repr__(self):
         return "type_(" +  ("" if self._baseclass is None else repr(self._baseclass)) + \
@@ -1240,229 +1586,410 @@ def type_(baseclass=None, metaclass=type):
     return TypeChecker(baseclass, metaclass)
 
 
-class _StackedDict(object):
-    __slots__ = ('_check', '_check_stack')
+class _StackedDict(dict):
+    """
+    A dict with snapshots. Instead of copying the dict, a snapshot records
+    the original values of the keys changed after it, so discarding a
+    snapshot only reverts these keys. Reading is not overridden and costs
+    the same as a dict.
+    """
+    __slots__ = ('_check_stack',)
     def __init__(self, *args, **kwargs):
-        self._check = [dict(*args, **kwargs)]
+        dict.__init__(self, *args, **kwargs)
         self._check_stack = []
     
-    def __contains__(self, key):
-        return any(key in d for d in self._check)
-    
-    def get(self, k, d = None):
-        for di in reversed(self._check):
-            if k in di:
-                return di[k]
-        return d
-    
-    def __getitem__(self, key):
-        for di in reversed(self._check):
-            if k in di:
-                return di[k]
-        raise KeyError(key)
-    
     def __setitem__(self, key, value):
-        self._check[-1][key] = value
+        if self._check_stack:
+            changes = self._check_stack[-1]
+            if key not in changes:
+                changes[key] = dict.get(self, key, _MISSING)
+        dict.__setitem__(self, key, value)
     
     def snapshot(self):
-        if len(self._check) >= 20:
-            self._check_stack.append(self._check)
-            merge_snapshots = {}
-            for d in self._check:
-                merge_snapshots.update(d)
-            self._check = [merge_snapshots]
-        new_dict = {}
-        self._check.append(new_dict)
+        self._check_stack.append({})
     
-    def _pop(self):
-        last_dict = self._check.pop()
-        if self._check_stack and len(self._check) <= 1:
-            self._check = self._check_stack.pop()
-        return last_dict
+    def clear(self):
+        dict.clear(self)
+        del self._check_stack[:]
     
     def discard_snapshot(self):
-        self._pop()
+        for k, v in self._check_stack.pop().items():
+            if v is _MISSING:
+                dict.__delitem__(self, k)
+            else:
+                dict.__setitem__(self, k, v)
     
     def merge_snapshot(self):
-        last_dict = self._pop()
-        to_merge = self._check[-1]
-        if len(to_merge) < len(last_dict):
-            last_dict.update(to_merge)
-            self._check[-1] = last_dict
-        else:
-            self._check[-1].update(last_dict)
+        changes = self._check_stack.pop()
+        if self._check_stack:
+            # The original values in the outer snapshot take precedence
+            to_merge = self._check_stack[-1]
+            if len(to_merge) < len(changes):
+                changes.update(to_merge)
+                self._check_stack[-1] = changes
+            else:
+                for k, v in changes.items():
+                    if k not in to_merge:
+                        to_merge[k] = v
+
+
+_dict_setitem = dict.__setitem__
+
 
+# Kinds of the entries in the check state. A current check stores its
+# result before checking the items, and the same entry is kept when it
+# succeeds: the result is the same object
+_CURRENT = 0
+_FAILED = 1
 
-def _customized_check(value, type_, checker, _recursive_check, _type_cache):
-    current_check, succeeded_check, failed_check, list_loop = \
-            _recursive_check
-    check_id = (id(value), id(type_))
+
+def _customized_check(type_, pre_check_type, final_check_type,
+                      value, _recursive_check, _type_cache):
+    check_state, list_loop = _recursive_check
+    check_id = id(value) << 64 | id(type_)
     if check_id in list_loop:
         raise TypeMismatchException(value, type_)
-    current_result = checker.pre_check_type(value)
+    current_result = pre_check_type(value)
     if current_result is None:
         # Prevent an infinite loop
         list_loop[check_id] = (value, type_)
+        _next_check = _recursive_check
+    else:
+        # Same as check_state[check_id] = ..., without the Python call:
+        # the check id is never in the state when it is checked, so the
+        # original value to record is always _MISSING
+        check_stack = check_state._check_stack
+        if check_stack:
+            check_stack[-1].setdefault(check_id, _MISSING)
+        _dict_setitem(check_state, check_id,
+                      (_CURRENT, current_result, value, type_))
+        # backup the check state: succeeded checks may depend on current
+        # result. If the type match fails, revert all of them
+        check_state.snapshot()
+        _next_check = (check_state, {})
+    # The `recursive_check_type` function passed to final_check_type.
+    # Same as _append_path(_check_type_inner, path, ...), but saves a
+    # Python call for every recursive check
+    def recursive_check_type(value, type, path=None):
+        try:
+            return _check_type_inner(value, type, _next_check, _type_cache)
+        except TypeMismatchException as e:
+            if path is not None:
+                e.append_path(path)
+            raise
+    if current_result is None:
         try:
-            current_result = checker.final_check_type(
-                                value,
-                                None,
-                                lambda value, type, path=None:
-                                    _append_path(_check_type_inner, path,
-                                        value, type, _recursive_check, _type_cache)
-                             )
+            return final_check_type(value, None, recursive_check_type)
         finally:
             del list_loop[check_id]
     else:
-        current_check[check_id] = (current_result, value, type_)
-        # backup succedded check: it may depends on current result.
-        # If the type match fails, revert all succeeded check
-        succeeded_check.snapshot()
-        _new_recursive_check = (current_check, succeeded_check,
-            failed_check, {})
         try:
-            checker.final_check_type(
-                value,
-                current_result,
-                lambda value, type, path=None:
-                    _append_path(_check_type_inner, path,
-                        value, type, _new_recursive_check, _type_cache)
-            )
+            final_check_type(value, current_result, recursive_check_type)
         except:
-            succeeded_check.discard_snapshot()
+            check_state.discard_snapshot()
             raise
         else:
-            succeeded_check.merge_snapshot()
-    return current_result
+            check_state.merge_snapshot()
+        return current_result
 
 
 def _indent(text, prepend = '  '):
     return ''.join(prepend + l for l in text.splitlines(True))
 
 
+def _compile_tuple(type_):
+    # Classes and None in the start of the union return the value itself
+    # when they match, so the value's types in them always match the union
+    # with the same result
+    exact_types = set()
+    for subtype in type_:
+        if subtype is None:
+            exact_types.add(type(None))
+        elif type(subtype) is _builtin_type:
+            exact_types.add(subtype)
+        else:
+            break
+    # Classes and None are tested with isinstance in the loop, same as
+    # _check_type_inner, so a mismatch does not raise an exception.
+    # (subtype, isinstance argument or None, excludes bool)
+    subtypes = []
+    for subtype in type_:
+        if subtype is None:
+            subtypes.append((subtype, type(None), False))
+        elif subtype is int or subtype is _long:
+            subtypes.append((subtype, _INT_TYPES, True))
+        elif subtype is str or subtype is _unicode:
+            subtypes.append((subtype, _STR_TYPES, False))
+        elif isinstance(subtype, _builtin_type):
+            subtypes.append((subtype, subtype, False))
+        else:
+            subtypes.append((subtype, None, False))
+    def _check_type(value, _recursive_check, _type_cache, type_ = type_,
+                    exact_types = frozenset(exact_types),
+                    subtypes = tuple(subtypes)):
+        if type(value) in exact_types:
+            return value
+        # exceptions, or the mismatched classes
+        es = []
+        for subtype, classes, no_bool in subtypes:
+            if classes is None:
+                try:
+                    return _check_type_inner(
+                                        value,
+                                        subtype,
+                                        _recursive_check,
+                                        _type_cache
+                                    )
+                except TypeMismatchException as e:
+                    es.append(e)
+            elif isinstance(value, classes) and \
+                    not (no_bool and isinstance(value, bool)):
+                return value
+            else:
+                es.append(subtype)
+        else:
+            raise TypeMismatchException(value, type_,
+                        'Not matched by any of the sub types:\n' +
+                        _indent('\n'.join(
+                            str(e) if isinstance(e, TypeMismatchException)
+                            else str(TypeMismatchException(value, e))
+                            for e in es)))
+    return _check_type
+
+
+def _compile_list(type_):
+    # The checker is private and never re-bound, so its methods can be
+    # selected once. partial() does not add a Python frame to each check
+    if not type_:
+        # the original type is still used for the check id
+        pre_check_type, final_check_type = _ANY_LIST_CHECKS
+    else:
+        pre_check_type, final_check_type = \
+                ListChecker(type_)._specialized_checks()
+    return partial(_customized_check, type_, pre_check_type,
+                   final_check_type)
+
+
+def _compile_dict(type_):
+    if not type_:
+        checker = _ANY_DICT
+    else:
+        checker = DictChecker(type_)
+    return partial(_customized_check, type_, checker.pre_check_type,
+                   checker.final_check_type)
+
+
+# Shared checkers for the common `[]` and `{}` types
+_ANY_LIST_CHECKS = ListChecker([])._specialized_checks()
+
+_ANY_DICT = DictChecker({})
+
+
+def _compile_customized(type_):
+    # A customized checker may be re-bound later (e.g. delayed init),
+    # look up its methods on every check
+    def _check_type(value, _recursive_check, _type_cache, type_ = type_):
+        return _customized_check(type_, type_.pre_check_type,
+                                 type_.final_check_type,
+                                 value, _recursive_check, _type_cache)
+    return _check_type
+
+
+# Compilers for the exact class of a type, other types (subclasses
+# and customized checkers) fall back to isinstance tests.
+# Python types are checked directly in _check_type_inner
+_COMPILERS = {tuple: _compile_tuple,
+              list: _compile_list,
+              dict: _compile_dict}
+
+
+# Compiled check functions of list, dict and tuple types, shared by all
+# check_type calls. key is id(type_), value is (type_, snapshot, check function).
+# type_ is stored to prevent it from being collected, or the id may be reused;
+# snapshot is used to detect modifications of list/dict types after compiling.
+_plan_cache = {}
+
+_PLAN_CACHE_SIZE = 1024
+
+
+def _type_snapshot(type_):
+    if isinstance(type_, dict):
+        return tuple(type_) + tuple(type_.values())
+    elif isinstance(type_, list):
+        return tuple(type_)
+    else:
+        return None
+
+
+def _same_items(a, b):
+    return len(a) == len(b) and all(map(_is, a, b))
+
+
+def _reaches_customized(type_):
+    """
+    Test whether a list, dict or tuple type contains a customized checker
+    at any depth
+    """
+    seen = set()
+    stack = [type_]
+    while stack:
+        t = stack.pop()
+        if isinstance(t, CustomizedChecker):
+            return True
+        elif id(t) in seen:
+            continue
+        seen.add(id(t))
+        if isinstance(t, dict):
+            stack.extend(t.values())
+        elif isinstance(t, (list, tuple)):
+            stack.extend(t)
+    return False
+
+
+def _get_plan(type_):
+    """
+    Get a compiled check function for type_, compile it if it is not
+    in the cache or the type is modified
+    """
+    type_id = id(type_)
+    snapshot = _type_snapshot(type_)
+    plan = _plan_cache.get(type_id)
+    if plan is not None and plan[0] is type_ and \
+            (snapshot is None or _same_items(plan[1], snapshot)):
+        return plan[2]
+    compiler = _COMPILERS.get(type(type_))
+    if compiler is not None:
+        _check_type = compiler(type_)
+    elif isinstance(type_, tuple):
+        _check_type = _compile_tuple(type_)
+    elif isinstance(type_, list):
+        _check_type = _compile_list(type_)
+    elif isinstance(type_, dict):
+        _check_type = _compile_dict(type_)
+    elif isinstance(type_, CustomizedChecker):
+        # Nothing is precomputed for a customized checker, and its
+        # callbacks may hold any objects. Keep it only in the caches
+        # of the current check_type call
+        return _compile_customized(type_)
+    else:
+        raise InvalidTypeException(type_, "Unrecognized type")
+    if _reaches_customized(type_):
+        # Keep types with customized checkers only in the caches of the
+        # current check_type call, same as the checkers themselves
+        return _check_type
+    if len(_plan_cache) >= _PLAN_CACHE_SIZE:
+        _plan_cache.clear()
+    _plan_cache[type_id] = (type_, snapshot, _check_type)
+    return _check_type
+
+
+# Caches of the current thread, reused by check_type calls
+_local = threading.local()
+
+
+def _check_type_root(value, type_):
+    context = getattr(_local, 'context', None)
+    if context is None:
+        # check state, listloop
+        # each has check id as their key. The check state stores
+        # (kind, result or exception, value, type_) for current (or
+        # succeeded) and failed checks. We must store the used value and
+        # types to prevent them from being collected, or the ids may be
+        # reused
+        # A new context is also created for a check_type call inside a
+        # customized checker, when the context of this thread is in use
+        context = ((_StackedDict(), {}), {})
+    else:
+        _local.context = None
+    _recursive_check, _type_cache = context
+    try:
+        return _check_type_inner(value, type_, _recursive_check, _type_cache)
+    finally:
+        for c in _recursive_check:
+            c.clear()
+        _type_cache.clear()
+        _local.context = context
+
+
 def _check_type_inner(value, type_, _recursive_check = None, _type_cache = None):
     # print('Check type:', value, id(value), type_, id(type_))
+    # Simple types never form a recursive structure; check them
+    # without touching the recursive check caches
+    if type_ is None:
+        # Match None only
+        if value is not None:
+            raise TypeMismatchException(value, type_)
+        return value
+    elif type_ is int or type_ is _long:
+        # Enhanced behavior when matching int type:
+        # long is also matched; bool is NOT matched
+        # Most values are exactly int, which skips both isinstance tests
+        value_type = type(value)
+        if value_type is int or \
+                (value_type is not bool and isinstance(value, _INT_TYPES)):
+            return value
+        raise TypeMismatchException(value, type_)
+    elif type_ is str or type_ is _unicode:
+        # Enhanced behavior when matching str:
+        # unicode is always matched (even in Python2)
+        if type(value) is str or isinstance(value, _STR_TYPES):
+            return value
+        raise TypeMismatchException(value, type_)
+    type_class = type(type_)
+    if type_class is dict or type_class is list:
+        # The most common composite types, skip the other tests
+        pass
+    elif type_class is _builtin_type or \
+            (type_class is not tuple and isinstance(type_, _builtin_type)):
+        # Classes are more common than the empty tuple, test them first
+        if isinstance(value, type_):
+            return value
+        raise TypeMismatchException(value, type_)
+    elif isinstance(type_, tuple) and not type_:
+        if value is None:
+            raise TypeMismatchException(value, type_)
+        return value
     if _recursive_check is None:
-        # current, succeeded, failed, listloop
-        # each has id-tuple as their key, and (result, value, type_) as the value.
-        # we must store the used value ans types to prevent them from being collected,
-        # or the ids may be reused
-        _recursive_check = ({}, _StackedDict(), {}, {})
-    if _type_cache is None:
-        _type_cache = {}
-    current_check, succeeded_check, failed_check, list_loop = \
-            _recursive_check
-    # Use (id(value), id(type)) to store matches that are done before
-    check_id = (id(value), id(type_))
-    _succ = succeeded_check.get(check_id)
-    if _succ is not None:
-        # This match is already done, return the result
-        # print('Hit succedded cache:', succeeded_check[check_id],
-        #    id(succeeded_check[check_id]))
-        return _succ[0]
-    elif check_id in failed_check:
-        # This match is already failed, raise the exception
-        exc = failed_check[check_id][0]
-        if isinstance(exc, TypeMismatchException):
-            exc = exc.clone()
-        else:
-            exc = _copy(exc)
-        raise exc
-    elif check_id in current_check:
-        # print('Hit succedded cache:', current_check[check_id],
-        #    id(current_check[check_id]))
-        # This match is in-operation. The final result is depended by
+        return _check_type_root(value, type_)
+    check_state = _recursive_check[0]
+    # Use (id(value), id(type)) to store matches that are done before.
+    # They are packed into one int (an id is never larger than 64 bits)
+    # to avoid creating a tuple for each check
+    check_id = id(value) << 64 | id(type_)
+    state = check_state.get(check_id)
+    if state is not None:
+        if state[0] == _FAILED:
+            # This match is already failed, raise the exception
+            exc = state[1]
+            if isinstance(exc, TypeMismatchException):
+                exc = exc.clone()
+            else:
+                exc = _copy(exc)
+            raise exc
+        # This match is already done, return the result; or
+        # this match is in-operation. The final result is depended by
         # itself. Return the object itself to form a recursive structure.
-        return current_check[check_id][0]
-    return_value = None
+        return state[1]
     try:
-        if type_ is None:
-            # Match None only
-            if value is not None:
-                raise TypeMismatchException(value, type_)
-            else:
-                return_value = value
-        elif type_ == ():
-            if value is None:
-                raise TypeMismatchException(value, type_)
-            else:
-                return_value = value
-        elif type_ is int or type_ is _long:
-            # Enhanced behavior when matching int type:
-            # long is also matched; bool is NOT matched
-            if not isinstance(value, bool) and (isinstance(value, int) \
-                    or isinstance(value, _long)):
-                return_value = value
-            else:
-                raise TypeMismatchException(value, type_)
-        elif type_ is str or type_ is _unicode:
-            # Enhanced behavior when matching str:
-            # unicode is always matched (even in Python2)
-            if isinstance(value, str) or isinstance(value, _unicode):
-                return_value = value
-            else:
-                raise TypeMismatchException(value, type_)
-        else:
-            type_id = id(type_)
-            if type_id in _type_cache:
-                return_value = _type_cache[type_id](value, _recursive_check, _type_cache)
-            elif isinstance(type_, type):
-                def _check_type(value, _recursive_check, _type_cache, type_ = type_):
-                    if isinstance(value, type_):
-                        return value
-                    else:
-                        raise TypeMismatchException(value, type_)
-                _type_cache[type_id] = _check_type
-                return_value = _check_type(value, _recursive_check, _type_cache)
-            elif isinstance(type_, tuple):
-                def _check_type(value, _recursive_check, _type_cache, type_ = type_):
-                    es = []
-                    for subtype in type_:
-                        try:
-                            return _check_type_inner(
-                                                value,
-                                                subtype,
-                                                _recursive_check,
-                                                _type_cache
-                                            )
-                        except TypeMismatchException as e:
-                            es.append(e)
-                    else:
-                        raise TypeMismatchException(value, type_,
-                                    'Not matched by any of the sub types:\n' + _indent('\n'.join(str(e) for e in es)))
-                _type_cache[type_id] = _check_type
-                return_value = _check_type(value, _recursive_check, _type_cache)
-            elif isinstance(type_, list):
-                def _check_type(value, _recursive_check, _type_cache, type_ = type_, checker=ListChecker(type_)):
-                    return _customized_check(value, type_, checker, _recursive_check, _type_cache)
-                _type_cache[type_id] = _check_type
-                return_value = _check_type(value, _recursive_check, _type_cache)
-            elif isinstance(type_, dict):
-                def _check_type(value, _recursive_check, _type_cache, type_ = type_, checker=DictChecker(type_)):
-                    return _customized_check(value, type_, checker, _recursive_check, _type_cache)
-                _type_cache[type_id] = _check_type
-                return_value = _check_type(value, _recursive_check, _type_cache)
-            elif isinstance(type_, CustomizedChecker):
-                def _check_type(value, _recursive_check, _type_cache, type_ = type_):
-                    return _customized_check(value, type_, type_, _recursive_check, _type_cache)
-                _type_cache[type_id] = _check_type
-                return_value = _check_type(value, _recursive_check, _type_cache)
-            else:
-                raise InvalidTypeException(type_, "Unrecognized type")
+        type_id = id(type_)
+        _check_type = _type_cache.get(type_id)
+        if _check_type is None:
+            _check_type = _type_cache[type_id] = _get_plan(type_)
+        return_value = _check_type(value, _recursive_check, _type_cache)
     except Exception as exc:
         # This match fails, store the exception
         if isinstance(exc, TypeMismatchException):
             exc = exc.clone()
-        failed_check[check_id] = (exc, value, type_)
-        if check_id in current_check:
-            del current_check[check_id]
+        # A failed check is never reverted. Its key is only recorded in
+        # the top snapshot, when it was entered as a current check
+        check_stack = check_state._check_stack
+        if check_stack:
+            check_stack[-1].pop(check_id, None)
+        _dict_setitem(check_state, check_id, (_FAILED, exc, value, type_))
         raise
     else:
-        # This match succeeded
-        if check_id in current_check:
-            del current_check[check_id]
-            # Only store the succeeded_check if necessary. 
-            succeeded_check[check_id] = (return_value, value, type_)
+        # This match succeeded. If it is stored as a current check, the
+        # entry is kept as the succeeded check
         return return_value
 
 if __name__ == '__main__':
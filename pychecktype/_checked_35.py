@@ -1,30 +1,17 @@
 """
 Wrap an async function
 """
-from pychecktype import check_type, _append_path
+from pychecktype import check_type, _append_path, _MISSING
 from functools import wraps
-import inspect
 
 
-def wrap_async(f, _inner_f, check_type_args, check_type_annotations):
+def wrap_async(f, _check_args, return_type):
     @wraps(f)
     async def _f(*args, **kwargs):
-        call_args = inspect.getcallargs(_inner_f, *args, **kwargs)
-        for k, v in list(call_args.items()):
-            if k in check_type_annotations:
-                call_args[k] = _append_path(check_type, k, v, check_type_annotations[k])
-        # Create arguments
-        args = [call_args.pop(a) for a in check_type_args.args]
-        if check_type_args.varargs is not None:
-            args.extend(call_args.pop(check_type_args.varargs))
-        if check_type_args.varkw is not None:
-            kwargs = call_args.pop(check_type_args.varkw)
-        else:
-            kwargs = {}
-        kwargs.update(call_args)
+        args, kwargs = _check_args(args, kwargs)
         _return = await f(*args, **kwargs)
-        if 'return' in check_type_annotations:
-            return _append_path(check_type, '<return>', _return, check_type_annotations['return'])
+        if return_type is not _MISSING:
+            return _append_path(check_type, '<return>', _return, return_type)
         else:
             return _return        
     return _f
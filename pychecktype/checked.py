@@ -1,7 +1,8 @@
 """
 Python 3 annotation based type-check
 """
-from pychecktype import check_type, _append_path
+from pychecktype import check_type, _append_path, _MISSING, \
+                        TypeMismatchException
 from functools import wraps
 import inspect
 import warnings
@@ -12,9 +13,112 @@ if sys.version_info >= (3,5):
 
 
 def _get_inner_function(f):
-    while hasattr(f, '__wrapped__'):
-        f = f.__wrapped__
-    return f
+    # Also stops with a ValueError on a cycle of __wrapped__
+    return inspect.unwrap(f)
+
+
+def _compile_args_check(f, check_type_annotations):
+    """
+    Create a function check_args(args, kwargs) -> (args, kwargs) to check
+    the annotated arguments of a call to `f`.
+    
+    The argument names are matched when the function is decorated, so a call
+    does not need inspect.getcallargs. Defaults of annotated arguments are also
+    checked; a default is only passed explicitly if the check converts it.
+    """
+    # The signature of a bound method does not include self
+    signature = inspect.signature(f)
+    parameters = signature.parameters.values()
+    positional = [p for p in parameters
+                  if p.kind == p.POSITIONAL_ONLY
+                      or p.kind == p.POSITIONAL_OR_KEYWORD]
+    arg_names = [p.name for p in positional]
+    nargs = len(arg_names)
+    # Positional-only arguments cannot be passed by keyword
+    posonly = sum(1 for p in positional if p.kind == p.POSITIONAL_ONLY)
+    defaults = tuple(p.default for p in positional
+                     if p.default is not p.empty)
+    default_start = nargs - len(defaults)
+    kwonlyargs = [p.name for p in parameters if p.kind == p.KEYWORD_ONLY]
+    # (index, name, type, default)
+    position_checks = tuple((i, p.name, check_type_annotations[p.name],
+                             _MISSING if p.default is p.empty else p.default)
+                            for i, p in enumerate(positional)
+                            if p.name in check_type_annotations)
+    # (name, type, default)
+    keyword_checks = tuple((p.name, check_type_annotations[p.name],
+                            _MISSING if p.default is p.empty else p.default)
+                           for p in parameters
+                           if p.kind == p.KEYWORD_ONLY
+                               and p.name in check_type_annotations)
+    varargs = None
+    varkw = None
+    for p in parameters:
+        if p.kind == p.VAR_POSITIONAL:
+            varargs = p.name
+        elif p.kind == p.VAR_KEYWORD:
+            varkw = p.name
+    if varargs is not None and varargs not in check_type_annotations:
+        varargs = None
+    if varkw is not None and varkw not in check_type_annotations:
+        varkw = None
+    # Names which can be passed by keyword, other keyword arguments
+    # go to **kwargs
+    arg_set = frozenset(arg_names[posonly:]).union(kwonlyargs)
+    def _check_default(kwargs, k, default, t):
+        v = _append_path(check_type, k, default, t)
+        if v is not default:
+            kwargs[k] = v
+    def _check_posonly_default(args, i, k, default, t):
+        v = _append_path(check_type, k, default, t)
+        if v is not default and len(args) >= default_start:
+            # Pass the defaults before it by position
+            args.extend(defaults[len(args) - default_start:i - default_start])
+            args.append(v)
+    def _check_typed_args(args, kwargs):
+        if position_checks or varargs is not None:
+            args = list(args)
+            given = len(args)
+            for i, k, t, default in position_checks:
+                if i < given:
+                    args[i] = _append_path(check_type, k, args[i], t)
+                elif i < posonly:
+                    if default is not _MISSING:
+                        _check_posonly_default(args, i, k, default, t)
+                elif k in kwargs:
+                    kwargs[k] = _append_path(check_type, k, kwargs[k], t)
+                elif default is not _MISSING:
+                    _check_default(kwargs, k, default, t)
+            if varargs is not None:
+                args[nargs:] = _append_path(check_type, varargs,
+                                            tuple(args[nargs:]),
+                                            check_type_annotations[varargs])
+        for k, t, default in keyword_checks:
+            if k in kwargs:
+                kwargs[k] = _append_path(check_type, k, kwargs[k], t)
+            elif default is not _MISSING:
+                _check_default(kwargs, k, default, t)
+        if varkw is not None:
+            extra_kwargs = {}
+            for k in kwargs:
+                if k not in arg_set:
+                    extra_kwargs[k] = kwargs[k]
+            checked_kwargs = _append_path(check_type, varkw, extra_kwargs,
+                                          check_type_annotations[varkw])
+            for k in extra_kwargs:
+                del kwargs[k]
+            kwargs.update(checked_kwargs)
+        return args, kwargs
+    def _check_args(args, kwargs):
+        try:
+            return _check_typed_args(args, kwargs)
+        except TypeMismatchException:
+            # The arguments are not matched with the parameters before the
+            # checks. When a check fails, report a wrong call with a TypeError
+            # first, as the call would do
+            signature.bind(*args, **kwargs)
+            raise
+    return _check_args
 
 
 def checked(f):
@@ -114,6 +218,46 @@ def checked(f):
         Traceback (most recent call last):
           ...
         pychecktype.TypeMismatchException: At 'a': 'a' cannot match type <class 'int'>
+        >>> @checked
+        ... def f3(a: [int], b: [int] = 1, *, c: [str] = 'c', d: int = None):
+        ...     return a, b, c, d
+        ...
+        >>> f3(1, d=2)
+        ([1], [1], ['c'], 2)
+        >>> f3(1, b=2, c='x', d=0)
+        ([1], [2], ['x'], 0)
+        >>> f3(a=1, d=2)
+        ([1], [1], ['c'], 2)
+        >>> f3(1)
+        Traceback (most recent call last):
+          ...
+        pychecktype.TypeMismatchException: At 'd': None cannot match type <class 'int'>
+        >>> f(1, 2, 3)
+        Traceback (most recent call last):
+          ...
+        TypeError: f() takes 2 positional arguments but 3 were given
+        >>> @checked
+        ... def f5(a: int, b: int, *rest: [str]):
+        ...     return a, b, rest
+        ...
+        >>> f5(1, 2, 3, a=1)
+        Traceback (most recent call last):
+          ...
+        TypeError: multiple values for argument 'a'
+        >>> f5('x')
+        Traceback (most recent call last):
+          ...
+        TypeError: missing a required argument: 'b'
+        >>> class A:
+        ...     def m(self, x: [int]):
+        ...         return x
+        ...
+        >>> checked(A().m)(1)
+        [1]
+        >>> checked(A().m)('a')
+        Traceback (most recent call last):
+          ...
+        pychecktype.TypeMismatchException: At 'x': 'a' cannot match type <class 'int'>
     """
     _inner_f = _get_inner_function(f)
     check_type_args = inspect.getfullargspec(_inner_f)
@@ -121,33 +265,45 @@ def checked(f):
     if not check_type_annotations:
         warnings.warn(UserWarning("Function " + repr(f) + " does not have annotations, checktype ignored."))
         return f
+    _check_args = _compile_args_check(_inner_f, check_type_annotations)
+    return_type = check_type_annotations.get('return', _MISSING)
     if PY35 and hasattr(inspect, 'iscoroutinefunction') and inspect.iscoroutinefunction(f):
-        _f = _checked_35.wrap_async(f, _inner_f, check_type_args, check_type_annotations)
+        _f = _checked_35.wrap_async(f, _check_args, return_type)
     else:
         # Notice: async generators are treated as normal functions
         @wraps(f)
         def _f(*args, **kwargs):
-            call_args = inspect.getcallargs(_inner_f, *args, **kwargs)
-            for k, v in list(call_args.items()):
-                if k in check_type_annotations:
-                    call_args[k] = _append_path(check_type, k, v, check_type_annotations[k])
-            # Create arguments
-            args = [call_args.pop(a) for a in check_type_args.args]
-            if check_type_args.varargs is not None:
-                args.extend(call_args.pop(check_type_args.varargs))
-            if check_type_args.varkw is not None:
-                kwargs = call_args.pop(check_type_args.varkw)
-            else:
-                kwargs = {}
-            kwargs.update(call_args)
+            args, kwargs = _check_args(args, kwargs)
             _return = f(*args, **kwargs)
-            if 'return' in check_type_annotations:
-                return _append_path(check_type, '<return>', _return, check_type_annotations['return'])
+            if return_type is not _MISSING:
+                return _append_path(check_type, '<return>', _return, return_type)
             else:
                 return _return        
     return _f
 
 
+if sys.version_info >= (3, 8):
+    # Positional-only parameters are a syntax error before Python 3.8
+    __test__ = {'checked_positional_only': """
+    Positional-only parameters cannot be passed by keyword::
+    
+    >>> @checked
+    ... def f4(a: [int] = 1, /, b: int = 2, **kw: {'?a': str}):
+    ...     return a, b, kw
+    ...
+    >>> f4()
+    ([1], 2, {})
+    >>> f4(b=3)
+    ([1], 3, {})
+    >>> f4(2, a='x')
+    ([2], 2, {'a': 'x'})
+    >>> f4(2, a=5)
+    Traceback (most recent call last):
+      ...
+    pychecktype.TypeMismatchException: At 'kw.a': 5 cannot match type <class 'str'>
+    """}
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()